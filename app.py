@@ -1,7 +1,10 @@
-from flask import Flask, render_template, jsonify, request
-from database import init_db
+from flask import Flask, render_template, jsonify, request, g
+from database import init_db, reclaim_all_events_async, set_current_event, reset_current_event, get_current_event, shard_exists
 from werkzeug.utils import secure_filename
+from profiler import mark_request_start, mark_request_end, sample_profile
 import openpyxl
+import hmac
+import math
 import os
 from models import (
     get_all_categories,
@@ -11,6 +14,9 @@ from models import (
     get_total_revenue,
     get_item_analytics,
     get_category_analytics,
+    get_event_analytics,
+    get_all_events_item_analytics,
+    get_all_events_category_analytics,
     create_item,
     update_item,
     delete_item,
@@ -23,12 +29,62 @@ from models import (
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+MAX_PROFILE_SECONDS = 60
+# Endpoints that read or change one event's bills. They answer 404 for an
+# event without a database; only creating a bill creates it.
+EVENT_ENDPOINTS = {
+    'api_bills',
+    'api_bill',
+    'api_clear_bills',
+    'api_revenue',
+    'api_item_analytics',
+    'api_category_analytics'
+}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Initialize database on startup
+def is_admin_request():
+    """Check the X-Admin-Token header against the configured ADMIN_TOKEN."""
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+# Initialize database on startup, then finish any interrupted space reclamation
 init_db()
+reclaim_all_events_async()
+
+@app.before_request
+def track_request_start():
+    """Record the endpoint being served so profiles can attribute samples."""
+    mark_request_start(request.endpoint)
+
+@app.teardown_request
+def track_request_end(exc=None):
+    """Clear the endpoint recorded for this request."""
+    mark_request_end()
+
+@app.before_request
+def route_event_shard():
+    """Route database access to the event named by ?event= or X-Event-Key."""
+    event_key = request.args.get('event') or request.headers.get('X-Event-Key')
+    try:
+        g.event_token = set_current_event(event_key)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Catalog endpoints and pages work for any event; bill endpoints need the
+    # event's database, which only creating a bill may create
+    creates_bill = request.endpoint == 'api_bills' and request.method == 'POST'
+    if request.endpoint in EVENT_ENDPOINTS and not creates_bill and not shard_exists(get_current_event()):
+        return jsonify({'error': f'Event "{event_key}" not found'}), 404
+
+@app.teardown_request
+def reset_event_shard(exc=None):
+    """Restore the default event routing after the request."""
+    token = g.pop('event_token', None)
+    if token is not None:
+        reset_current_event(token)
 
 @app.route('/')
 def index():
@@ -143,6 +199,24 @@ def api_category_analytics():
     analytics = get_category_analytics()
     return jsonify(analytics)
 
+@app.route('/api/analytics/events', methods=['GET'])
+def api_event_analytics():
+    """Get per-event sales analytics across all event databases."""
+    analytics = get_event_analytics()
+    return jsonify(analytics)
+
+@app.route('/api/analytics/events/items', methods=['GET'])
+def api_event_item_analytics():
+    """Get per-item sales analytics across all events."""
+    analytics = get_all_events_item_analytics()
+    return jsonify(analytics)
+
+@app.route('/api/analytics/events/categories', methods=['GET'])
+def api_event_category_analytics():
+    """Get per-category sales analytics across all events."""
+    analytics = get_all_events_category_analytics()
+    return jsonify(analytics)
+
 @app.route('/api/bills/<int:bill_id>', methods=['GET', 'PUT', 'DELETE'])
 def api_bill(bill_id):
     """Get, update, or delete a specific bill."""
@@ -178,10 +252,16 @@ def api_bill(bill_id):
 
 @app.route('/api/bills/clear', methods=['POST'])
 def api_clear_bills():
-    """Clear all bills and analytics data."""
+    """Clear all bills and analytics data, optionally keeping a snapshot."""
+    data = request.get_json(silent=True) or {}
+    keep_snapshot = bool(data.get('keep_snapshot'))
+    
     try:
-        clear_all_bills()
-        return jsonify({'message': 'All sales and analytics data cleared successfully'}), 200
+        snapshot = clear_all_bills(keep_snapshot=keep_snapshot)
+        response = {'message': 'All sales and analytics data cleared successfully'}
+        if snapshot:
+            response['snapshot'] = snapshot
+        return jsonify(response), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -269,6 +349,26 @@ def api_import_excel():
     except Exception as e:
         return jsonify({'error': f'Error processing file: {str(e)}'}), 400
 
+@app.route('/api/debug/profile', methods=['GET'])
+def api_debug_profile():
+    """Sample request threads for N seconds and return aggregated stacks (admin only)."""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Profiling is disabled: ADMIN_TOKEN is not configured'}), 403
+    if not is_admin_request():
+        return jsonify({'error': 'Admin token required'}), 403
+    
+    try:
+        seconds = float(request.args.get('seconds', 10))
+    except ValueError:
+        return jsonify({'error': 'seconds must be a number'}), 400
+    if not math.isfinite(seconds) or seconds <= 0 or seconds > MAX_PROFILE_SECONDS:
+        return jsonify({'error': f'seconds must be between 0 and {MAX_PROFILE_SECONDS}'}), 400
+    
+    profile = sample_profile(seconds)
+    if request.args.get('format') == 'collapsed':
+        return app.response_class(profile['collapsed'], mimetype='text/plain')
+    return jsonify(profile)
+
 if __name__ == '__main__':
    # app.run(debug=True, port=5000)
     port = int(os.environ.get("PORT", 5000))
@@ -1,20 +1,239 @@
 import sqlite3
+from collections import OrderedDict
+from contextvars import ContextVar
 from datetime import datetime
+import threading
+import logging
+import time
+import sys
 import os
+import re
 
 DB_NAME = 'pos_system.db'
 
-def get_db_connection():
-    """Create and return a database connection."""
-    conn = sqlite3.connect(DB_NAME)
+# Per-event shards: each event (or stall) keeps its bills in its own file
+# under EVENTS_DIR, while the catalog (categories, items) stays in DB_NAME.
+# The default event uses DB_NAME for everything.
+EVENTS_DIR = 'events'
+DEFAULT_EVENT = 'default'
+EVENT_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Idle connections kept open per shard and across all shards (least
+# recently used shards are evicted first), and shards ATTACHed per
+# cross-shard query (SQLite's default attach limit is 10).
+MAX_IDLE_CONNECTIONS = 5
+MAX_IDLE_CONNECTIONS_TOTAL = 20
+MAX_ATTACHED_SHARDS = 10
+
+# Background space reclamation tuning: rows deleted per transaction and
+# pages released per incremental_vacuum step, kept small so each step only
+# holds the write lock briefly.
+RECLAIM_BATCH_SIZE = 1000
+INCREMENTAL_VACUUM_PAGES = 500
+# Attempts, and seconds between them, when reclamation hits a busy database
+RECLAIM_RETRIES = 5
+RECLAIM_RETRY_DELAY = 5
+
+logger = logging.getLogger(__name__)
+
+_reclaim_locks_lock = threading.Lock()
+_reclaim_locks = {}
+
+_current_event = ContextVar('current_event', default=DEFAULT_EVENT)
+_pool_lock = threading.Lock()
+# Shard path -> idle connections, least recently used shard first
+_idle_connections = OrderedDict()
+_shard_init_lock = threading.Lock()
+
+class PooledConnection(sqlite3.Connection):
+    """Connection whose close() returns it to its shard's idle pool."""
+    
+    shard_path = None
+    
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+        if self.shard_path is not None and release_connection(self):
+            return
+        super().close()
+
+def release_connection(conn):
+    """Return a connection to its shard's idle pool.
+
+    Returns False if the shard's pool is full. Once the pool as a whole
+    is over MAX_IDLE_CONNECTIONS_TOTAL, idle connections of the least
+    recently used shards are closed.
+    """
+    evicted = []
+    with _pool_lock:
+        idle = _idle_connections.setdefault(conn.shard_path, [])
+        _idle_connections.move_to_end(conn.shard_path)
+        if len(idle) >= MAX_IDLE_CONNECTIONS:
+            return False
+        idle.append(conn)
+        
+        idle_count = sum(len(connections) for connections in _idle_connections.values())
+        while idle_count > MAX_IDLE_CONNECTIONS_TOTAL:
+            shard_path, connections = next(iter(_idle_connections.items()))
+            evicted.append(connections.pop(0))
+            idle_count -= 1
+            if not connections:
+                del _idle_connections[shard_path]
+    
+    for idle_conn in evicted:
+        sqlite3.Connection.close(idle_conn)
+    return True
+
+def set_current_event(event_key):
+    """Route database access in the current context to an event shard.
+
+    Returns a token for reset_current_event. Raises ValueError for keys
+    that are not safe to use as file names.
+    """
+    event_key = event_key or DEFAULT_EVENT
+    if not EVENT_KEY_PATTERN.match(event_key):
+        raise ValueError('Invalid event key: use 1-64 letters, digits, "-" or "_"')
+    return _current_event.set(event_key)
+
+def reset_current_event(token):
+    """Restore the event routing that was active before set_current_event."""
+    _current_event.reset(token)
+
+def get_current_event():
+    """Get the event key database access is currently routed to."""
+    return _current_event.get()
+
+def get_shard_path(event_key):
+    """Get the database file that holds bills for an event."""
+    if event_key == DEFAULT_EVENT:
+        return DB_NAME
+    return os.path.join(EVENTS_DIR, f'{event_key}.db')
+
+def shard_exists(event_key):
+    """Check whether an event's database has been created."""
+    return event_key == DEFAULT_EVENT or os.path.exists(get_shard_path(event_key))
+
+def list_event_keys():
+    """List the default event and every event that has a shard file."""
+    event_keys = [DEFAULT_EVENT]
+    if os.path.isdir(EVENTS_DIR):
+        for filename in sorted(os.listdir(EVENTS_DIR)):
+            name, ext = os.path.splitext(filename)
+            if ext == '.db' and EVENT_KEY_PATTERN.match(name) and name != DEFAULT_EVENT:
+                event_keys.append(name)
+    return event_keys
+
+def get_db_connection(event_key=None):
+    """Return a cached or new connection for an event shard.
+
+    Uses the current event when event_key is not given, creating its shard
+    if it doesn't exist yet. Shard connections have the catalog database
+    ATTACHed, so unqualified queries on items and categories still work
+    while bills and bill_items resolve to the shard.
+    """
+    event_key = event_key or get_current_event()
+    shard_path = get_shard_path(event_key)
+    
+    with _pool_lock:
+        idle = _idle_connections.get(shard_path)
+        if idle:
+            conn = idle.pop()
+            if not idle:
+                del _idle_connections[shard_path]
+            return conn
+    
+    if shard_path != DB_NAME and not os.path.exists(shard_path):
+        create_shard(shard_path)
+    conn = sqlite3.connect(shard_path, check_same_thread=False, factory=PooledConnection)
     conn.row_factory = sqlite3.Row
+    conn.shard_path = shard_path
+    
+    if shard_path != DB_NAME:
+        conn.execute('ATTACH DATABASE ? AS catalog', (DB_NAME,))
     return conn
 
+def attach_event_shards(event_keys):
+    """Open an uncached catalog connection with event shards ATTACHed.
+
+    Returns the connection and the schema name to query for each event
+    key, in order. The default event's bills live in the main schema.
+    """
+    conn = sqlite3.connect(DB_NAME)
+    conn.row_factory = sqlite3.Row
+    schemas = []
+    for index, event_key in enumerate(event_keys):
+        if event_key == DEFAULT_EVENT:
+            schemas.append('main')
+            continue
+        schema = f'shard_{index}'
+        conn.execute(f'ATTACH DATABASE ? AS {schema}', (get_shard_path(event_key),))
+        schemas.append(schema)
+    return conn, schemas
+
+def enable_incremental_vacuum(cursor):
+    """Request incremental auto-vacuum for the main database.
+
+    Incremental auto-vacuum lets freed pages be returned to the OS in the
+    background after an event reset. This takes effect on a new file before
+    any tables exist; existing files keep their mode until converted with
+    convert_to_incremental_vacuum.
+    """
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
+def is_incremental_vacuum(cursor):
+    """Check whether the main database uses incremental auto-vacuum."""
+    cursor.execute('PRAGMA auto_vacuum')
+    return cursor.fetchone()[0] == 2
+
+def convert_to_incremental_vacuum(event_key=DEFAULT_EVENT):
+    """Switch an existing database to incremental auto-vacuum.
+
+    This runs a full VACUUM, which locks the whole file for its duration,
+    so it is a one-time step to run while no sales are live. Returns False
+    if the database was already in incremental mode.
+    """
+    conn = get_db_connection(event_key)
+    try:
+        cursor = conn.cursor()
+        if is_incremental_vacuum(cursor):
+            return False
+        enable_incremental_vacuum(cursor)
+        cursor.execute('VACUUM')
+        return True
+    finally:
+        conn.close()
+
+def create_shard(shard_path):
+    """Create a shard file, publishing it under its final name only once initialized."""
+    with _shard_init_lock:
+        if os.path.exists(shard_path):
+            return
+        os.makedirs(EVENTS_DIR, exist_ok=True)
+        
+        # Build under a name list_event_keys ignores, so cross-shard queries
+        # never see a file without tables
+        temp_path = f'{shard_path}.tmp'
+        conn = sqlite3.connect(temp_path)
+        try:
+            init_shard(conn)
+        finally:
+            conn.close()
+        os.replace(temp_path, shard_path)
+
+def init_shard(conn):
+    """Initialize a per-event shard with the bill tables."""
+    cursor = conn.cursor()
+    enable_incremental_vacuum(cursor)
+    create_bill_tables(cursor)
+    conn.commit()
+
 def init_db():
-    """Initialize the database with all required tables."""
-    conn = get_db_connection()
+    """Initialize the catalog database with all required tables."""
+    conn = get_db_connection(DEFAULT_EVENT)
     cursor = conn.cursor()
     
+    enable_incremental_vacuum(cursor)
+    
     # Create categories table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS categories (
@@ -45,6 +264,21 @@ def init_db():
         # Column already exists, ignore the error
         pass
     
+    create_bill_tables(cursor)
+    
+    conn.commit()
+    
+    # Check if database is empty and seed with sample data
+    cursor.execute('SELECT COUNT(*) as count FROM categories')
+    category_count = cursor.fetchone()['count']
+    
+    if category_count == 0:
+        seed_sample_data(cursor, conn)
+    
+    conn.close()
+
+def create_bill_tables(cursor):
+    """Create the bills and bill_items tables if they don't exist."""
     # Create bills table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS bills (
@@ -68,17 +302,93 @@ def init_db():
             FOREIGN KEY (item_id) REFERENCES items(id)
         )
     ''')
-    
-    conn.commit()
-    
-    # Check if database is empty and seed with sample data
-    cursor.execute('SELECT COUNT(*) as count FROM categories')
-    category_count = cursor.fetchone()['count']
-    
-    if category_count == 0:
-        seed_sample_data(cursor, conn)
-    
-    conn.close()
+
+def get_reclaim_lock(shard_path):
+    """Get the lock that serializes space reclamation for one shard file."""
+    with _reclaim_locks_lock:
+        return _reclaim_locks.setdefault(shard_path, threading.Lock())
+
+def reclaim_space(event_key=None):
+    """Drain discarded bill tables in small batches and release freed pages.
+
+    Tables renamed to '*_discarded_*' by clear_all_bills are emptied a batch
+    at a time and dropped, then free pages are handed back to the OS with
+    incremental vacuum, committing between steps so live sales never wait
+    long for the write lock.
+    """
+    event_key = event_key or get_current_event()
+    for attempt in range(1, RECLAIM_RETRIES + 1):
+        try:
+            with get_reclaim_lock(get_shard_path(event_key)):
+                drain_discarded_tables(event_key)
+            return True
+        except sqlite3.OperationalError as e:
+            # Usually "database is locked" under heavy checkout traffic; the
+            # discarded tables are still there, so the next attempt resumes
+            logger.warning('Reclaiming space for event %s failed (attempt %d/%d): %s',
+                           event_key, attempt, RECLAIM_RETRIES, e)
+            if attempt < RECLAIM_RETRIES:
+                time.sleep(RECLAIM_RETRY_DELAY * attempt)
+    logger.error('Giving up reclaiming space for event %s; it will be retried '
+                 'at the next reset or restart', event_key)
+    return False
+
+def drain_discarded_tables(event_key):
+    """Empty and drop one shard's discarded tables, then release free pages."""
+    conn = get_db_connection(event_key)
+    try:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name LIKE '%\\_discarded\\_%' ESCAPE '\\'
+            ORDER BY name
+        ''')
+        tables = [row['name'] for row in cursor.fetchall()]
+        
+        for table in tables:
+            while True:
+                cursor.execute(f'''
+                    DELETE FROM "{table}"
+                    WHERE rowid IN (SELECT rowid FROM "{table}" LIMIT ?)
+                ''', (RECLAIM_BATCH_SIZE,))
+                deleted = cursor.rowcount
+                conn.commit()
+                if deleted < RECLAIM_BATCH_SIZE:
+                    break
+                time.sleep(0.01)
+            cursor.execute(f'DROP TABLE "{table}"')
+            conn.commit()
+        
+        # Without incremental mode freed pages stay in the file for reuse
+        if not is_incremental_vacuum(cursor):
+            return
+        
+        previous_free_pages = None
+        while True:
+            cursor.execute('PRAGMA freelist_count')
+            free_pages = cursor.fetchone()[0]
+            if free_pages == 0 or free_pages == previous_free_pages:
+                break
+            previous_free_pages = free_pages
+            cursor.execute(f'PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES})')
+            cursor.fetchall()
+            conn.commit()
+            time.sleep(0.01)
+    finally:
+        conn.close()
+
+def reclaim_space_async(event_key=None):
+    """Run reclaim_space for an event shard in a background thread."""
+    # Context variables don't carry over to new threads, so resolve it here
+    event_key = event_key or get_current_event()
+    thread = threading.Thread(target=reclaim_space, args=(event_key,), daemon=True)
+    thread.start()
+    return thread
+
+def reclaim_all_events_async():
+    """Resume reclamation left over from a previous run, for every event."""
+    return [reclaim_space_async(event_key) for event_key in list_event_keys()]
 
 def seed_sample_data(cursor, conn):
     """Seed the database with sample categories and items for testing."""
@@ -122,4 +432,9 @@ def seed_sample_data(cursor, conn):
 if __name__ == '__main__':
     init_db()
     print(f"Database '{DB_NAME}' initialized successfully!")
+    
+    if '--enable-incremental-vacuum' in sys.argv:
+        for event_key in list_event_keys():
+            if convert_to_incremental_vacuum(event_key):
+                print(f"Enabled incremental vacuum for '{get_shard_path(event_key)}'")
 
@@ -1,4 +1,12 @@
-from database import get_db_connection
+from database import (
+    get_db_connection,
+    create_bill_tables,
+    reclaim_space_async,
+    attach_event_shards,
+    list_event_keys,
+    DEFAULT_EVENT,
+    MAX_ATTACHED_SHARDS
+)
 from datetime import datetime
 import uuid
 
@@ -9,8 +17,8 @@ def generate_bill_number():
     return f'BILL-{timestamp}-{unique_id}'
 
 def get_all_categories():
-    """Get all categories from the database."""
-    conn = get_db_connection()
+    """Get all categories from the catalog database."""
+    conn = get_db_connection(DEFAULT_EVENT)
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM categories ORDER BY name')
     categories = [dict(row) for row in cursor.fetchall()]
@@ -19,7 +27,7 @@ def get_all_categories():
 
 def get_all_items(category_id=None):
     """Get all items, optionally filtered by category."""
-    conn = get_db_connection()
+    conn = get_db_connection(DEFAULT_EVENT)
     cursor = conn.cursor()
     
     if category_id:
@@ -140,9 +148,108 @@ def get_category_analytics():
     conn.close()
     return analytics
 
+def query_all_events(query, params=()):
+    """Run a query against every event shard and combine the rows.
+
+    The query is formatted with {schema} for each ATTACHed shard and bound
+    with the event key followed by params, so it should select '? as event'.
+    """
+    event_keys = list_event_keys()
+    rows = []
+    
+    # Attach shards in batches to stay under SQLite's attached database limit
+    for start in range(0, len(event_keys), MAX_ATTACHED_SHARDS):
+        batch = event_keys[start:start + MAX_ATTACHED_SHARDS]
+        conn, schemas = attach_event_shards(batch)
+        union = ' UNION ALL '.join(query.format(schema=schema) for schema in schemas)
+        bound = [value for event_key in batch for value in (event_key, *params)]
+        cursor = conn.cursor()
+        cursor.execute(union, bound)
+        rows.extend(dict(row) for row in cursor.fetchall())
+        conn.close()
+    
+    return rows
+
+def get_event_analytics():
+    """Get bill count and revenue per event, aggregated over ATTACHed shards."""
+    events = query_all_events('''
+        SELECT
+            ? as event,
+            COUNT(*) as bill_count,
+            COALESCE(SUM(total_amount), 0) as total_revenue
+        FROM {schema}.bills
+    ''')
+    
+    events.sort(key=lambda event: event['total_revenue'], reverse=True)
+    return {
+        'events': events,
+        'total_bills': sum(event['bill_count'] for event in events),
+        'total_revenue': sum(event['total_revenue'] for event in events)
+    }
+
+def get_all_events_item_sales():
+    """Get quantity sold and revenue per item id, summed over every event."""
+    rows = query_all_events('''
+        SELECT
+            ? as event,
+            item_id,
+            SUM(quantity) as quantity,
+            SUM(subtotal) as revenue
+        FROM {schema}.bill_items
+        GROUP BY item_id
+    ''')
+    
+    # Each ATTACH batch is grouped separately, so combine the batches here
+    sales = {}
+    for row in rows:
+        quantity, revenue = sales.get(row['item_id'], (0, 0))
+        sales[row['item_id']] = (quantity + row['quantity'], revenue + row['revenue'])
+    return sales
+
+def get_all_events_item_analytics():
+    """Get per-item sales analytics across every event."""
+    sales = get_all_events_item_sales()
+    analytics = []
+    for item in get_all_items():
+        quantity, revenue = sales.get(item['id'], (0, 0))
+        analytics.append({
+            'id': item['id'],
+            'name': item['name'],
+            'price': item['price'],
+            'category_name': item['category_name'],
+            'total_quantity_sold': quantity,
+            'total_revenue': revenue
+        })
+    
+    analytics.sort(key=lambda item: (-item['total_revenue'], item['category_name'], item['name']))
+    return analytics
+
+def get_all_events_category_analytics():
+    """Get per-category sales analytics across every event."""
+    sales = get_all_events_item_sales()
+    categories = get_all_categories()
+    totals = {category['id']: [0, 0] for category in categories}
+    for item in get_all_items():
+        quantity, revenue = sales.get(item['id'], (0, 0))
+        if item['category_id'] in totals:
+            totals[item['category_id']][0] += quantity
+            totals[item['category_id']][1] += revenue
+    
+    analytics = [
+        {
+            'id': category['id'],
+            'name': category['name'],
+            'total_items_sold': totals[category['id']][0],
+            'total_revenue': totals[category['id']][1]
+        }
+        for category in categories
+    ]
+    analytics.sort(key=lambda category: (-category['total_revenue'], category['name']))
+    return analytics
+
 def create_item(category_id, name, price, image_url=None):
     """Create a new item."""
-    conn = get_db_connection()
+    conn = get_db_connection(DEFAULT_EVENT)
     cursor = conn.cursor()
     cursor.execute('''
         INSERT INTO items (category_id, name, price, image_url)
@@ -164,7 +271,7 @@ def create_item(category_id, name, price, image_url=None):
 
 def update_item(item_id, category_id, name, price, image_url=None):
     """Update an existing item."""
-    conn = get_db_connection()
+    conn = get_db_connection(DEFAULT_EVENT)
     cursor = conn.cursor()
     cursor.execute('''
         UPDATE items
@@ -186,41 +293,62 @@ def update_item(item_id, category_id, name, price, image_url=None):
 
 def delete_item(item_id):
     """Delete an item if it hasn't been used in any bills."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if item has been used in bills
-    cursor.execute('''
-        SELECT COUNT(*) as count
-        FROM bill_items
+    # Items are shared by all events, so check bills in every shard
+    usage = query_all_events('''
+        SELECT ? as event, COUNT(*) as count
+        FROM {schema}.bill_items
         WHERE item_id = ?
     ''', (item_id,))
-    result = cursor.fetchone()
+    count = sum(row['count'] for row in usage)
     
-    if result['count'] > 0:
-        conn.close()
-        raise ValueError(f'Cannot delete item: it has been used in {result["count"]} bill(s)')
+    if count > 0:
+        raise ValueError(f'Cannot delete item: it has been used in {count} bill(s)')
     
     # Delete the item
+    conn = get_db_connection(DEFAULT_EVENT)
+    cursor = conn.cursor()
     cursor.execute('DELETE FROM items WHERE id = ?', (item_id,))
     conn.commit()
     conn.close()
     return True
 
-def clear_all_bills():
-    """Clear all bills and bill_items from the database."""
+def clear_all_bills(keep_snapshot=False):
+    """Reset sales data by swapping in fresh, empty bills and bill_items tables.
+
+    The current tables are renamed rather than deleted row by row, so the
+    reset takes constant time regardless of how many bills exist. With
+    keep_snapshot the old tables are kept as bills_snapshot_<suffix> and
+    bill_items_snapshot_<suffix>; otherwise they are marked as discarded and
+    drained by a background reclaim thread. Returns the snapshot suffix, or
+    None when no snapshot was kept.
+    """
+    suffix = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    kind = 'snapshot' if keep_snapshot else 'discarded'
+    
     conn = get_db_connection()
     cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        # Renaming also rewrites bill_items' foreign key to the renamed bills
+        cursor.execute(f'ALTER TABLE bill_items RENAME TO bill_items_{kind}_{suffix}')
+        cursor.execute(f'ALTER TABLE bills RENAME TO bills_{kind}_{suffix}')
+        create_bill_tables(cursor)
+        # The rename moved the AUTOINCREMENT counters to the old tables;
+        # carry them over so ids from before the reset are never reused
+        for table in ('bills', 'bill_items'):
+            cursor.execute('''
+                INSERT INTO sqlite_sequence (name, seq)
+                SELECT ?, seq FROM sqlite_sequence WHERE name = ?
+            ''', (table, f'{table}_{kind}_{suffix}'))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
     
-    # Delete all bill_items first (due to foreign key constraint)
-    cursor.execute('DELETE FROM bill_items')
-    
-    # Delete all bills
-    cursor.execute('DELETE FROM bills')
-    
-    conn.commit()
-    conn.close()
-    return True
+    reclaim_space_async()
+    return suffix if keep_snapshot else None
 
 def get_bill_with_items(bill_id):
     """Get a bill with its items."""
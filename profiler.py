@@ -0,0 +1,99 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Maps thread ident -> Flask endpoint name of the request the thread is serving
+_active_requests = {}
+
+def mark_request_start(endpoint):
+    """Record which endpoint the current thread is serving."""
+    _active_requests[threading.get_ident()] = endpoint or 'unknown'
+
+def mark_request_end():
+    """Forget the endpoint recorded for the current thread."""
+    _active_requests.pop(threading.get_ident(), None)
+
+def _frame_label(frame):
+    """Format a frame as 'file:function' for collapsed stacks."""
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+def _collect_stack(frame):
+    """Return the stack of a frame as a list of labels, outermost first."""
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def sample_profile(seconds, interval=0.005, top=25):
+    """Sample the stacks of all request-serving threads for a time window.
+
+    Only threads currently handling a request are sampled, and each stack is
+    rooted at the endpoint name (e.g. api_bills) so hot spots can be
+    attributed to routes. Returns collapsed stacks (one 'frame;frame;... count'
+    line per unique stack, as consumed by flamegraph.pl / speedscope) and a
+    top-functions table with self and inclusive sample counts.
+    """
+    own_thread = threading.get_ident()
+    stacks = Counter()
+    self_counts = Counter()
+    total_counts = Counter()
+    endpoint_counts = Counter()
+    sample_rounds = 0
+
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frames = sys._current_frames()
+        for thread_id, frame in frames.items():
+            if thread_id == own_thread:
+                continue
+            endpoint = _active_requests.get(thread_id)
+            if endpoint is None:
+                continue
+
+            stack = _collect_stack(frame)
+            if not stack:
+                continue
+            stacks[(endpoint,) + tuple(stack)] += 1
+            endpoint_counts[endpoint] += 1
+            self_counts[stack[-1]] += 1
+            # Count each function once per sample for inclusive time
+            for label in set(stack):
+                total_counts[label] += 1
+        del frames
+        sample_rounds += 1
+        time.sleep(interval)
+
+    total_samples = sum(stacks.values())
+    collapsed = '\n'.join(
+        f'{";".join(stack)} {count}'
+        for stack, count in stacks.most_common()
+    )
+    top_functions = [
+        {
+            'function': label,
+            'self_samples': self_counts[label],
+            'total_samples': count,
+            'self_percent': round(100.0 * self_counts[label] / total_samples, 2),
+            'total_percent': round(100.0 * count / total_samples, 2),
+        }
+        for label, count in sorted(
+            total_counts.items(),
+            key=lambda entry: (self_counts[entry[0]], entry[1]),
+            reverse=True
+        )[:top]
+    ]
+
+    return {
+        'seconds': seconds,
+        'interval': interval,
+        'sample_rounds': sample_rounds,
+        'total_samples': total_samples,
+        'endpoints': dict(endpoint_counts.most_common()),
+        'top_functions': top_functions,
+        'collapsed': collapsed,
+    }